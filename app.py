@@ -1,18 +1,117 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, send_from_directory
+from flask import Flask, render_template, request, jsonify, redirect, url_for, send_from_directory, g, Response, stream_with_context
+from flask.helpers import get_debug_flag
+from flask.json.provider import DefaultJSONProvider
+import orjson
 import sqlite3
+import hashlib
 import json
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
 import os
+import queue
 import re
 import uuid
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes and decodes with orjson"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # Configuration
+DATABASE = 'nzc_activator.db'
 UPLOAD_FOLDER = 'uploads/photos'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+MAX_UPLOAD_SIZE = 20 * MAX_FILE_SIZE  # Whole upload request, up to 20 photos
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB
+STREAM_BATCH_SIZE = 256  # Session rows encoded per streamed chunk
+API_CACHE_CONTROL = 'private, no-cache'  # Always revalidate; unchanged data costs a 304
+DB_POOL_SIZE = int(os.environ.get('WEB_THREADS', 8))  # Idle connections kept per process, one per server thread
+
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
+
+# Keep photo bytes out of the Python worker in production. Behind Apache
+# mod_xsendfile or lighttpd set USE_X_SENDFILE=1 so the server streams the file;
+# behind nginx serve the folder directly instead:
+#   location /uploads/photos/ { alias /app/uploads/photos/; sendfile on; }
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+
+# Validation rules
+_ACTIVATOR_RE = re.compile(r'^[a-zA-Z\s\-\.]+$')
+_REQUIRED_FIELDS = ('school_name', 'session_type', 'location', 'activator', 'year_group',
+                    'male_participants', 'female_participants', 'session_date', 'session_duration')
+_VALID_YEAR_GROUPS = frozenset(['Year 1-2', 'Year 3-4', 'Year 5-6', 'Year 7-8', 'Year 9-10', 'Year 11-13', 'Mixed'])
+_TEXT_FIELD_LIMITS = (  # (field, label, min length, max length)
+    ('school_name', 'School name', 2, 100),
+    ('session_type', 'Session type', 2, 50),
+    ('location', 'Location', 2, 100),
+    ('activator', 'Activator name', 2, 50),
+)
+_PARTICIPANT_FIELDS = (('male_participants', 'Male participants'), ('female_participants', 'Female participants'))
+_SESSION_FIELDS = (  # (field, converter, optional) in INSERT/UPDATE column order
+    ('school_name', str.strip, False),
+    ('session_type', str.strip, False),
+    ('location', str.strip, False),
+    ('activator', str.strip, False),
+    ('year_group', str, False),
+    ('male_participants', int, False),
+    ('female_participants', int, False),
+    ('teacher_feedback', str.strip, True),
+    ('session_date', str, False),
+    ('session_duration', int, False),
+    ('latitude', float, True),
+    ('longitude', float, True),
+)
+
+# SQL statements reused by the API routes
+# The per-row photo count subquery (instead of JOIN + GROUP BY) lets the list
+# walk idx_sessions_date_created in order, so streamed rows start immediately
+_SELECT_SESSIONS_SQL = '''
+    SELECT s.id, s.school_name, s.session_type, s.location, s.activator, s.year_group, 
+           s.male_participants, s.female_participants, s.teacher_feedback, s.session_date, 
+           s.session_duration, s.date_created, s.latitude, s.longitude,
+           (SELECT COUNT(*) FROM session_photos sp WHERE sp.session_id = s.id) as photo_count,
+           s.total_participants
+    FROM sessions s
+    ORDER BY s.session_date DESC, s.date_created DESC
+'''
+
+_INSERT_SESSION_SQL = '''
+    INSERT INTO sessions (school_name, session_type, location, activator, year_group, 
+                        male_participants, female_participants, teacher_feedback, session_date,
+                        session_duration, latitude, longitude)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Same insert, returning the new row in the shape of the session list
+_CREATE_SESSION_SQL = _INSERT_SESSION_SQL + '''
+    RETURNING id, school_name, session_type, location, activator, year_group,
+              male_participants, female_participants, teacher_feedback, session_date,
+              session_duration, date_created, latitude, longitude,
+              0 as photo_count, total_participants
+'''
+
+_UPDATE_SESSION_SQL = '''
+    UPDATE sessions 
+    SET school_name=?, session_type=?, location=?, activator=?, year_group=?, 
+        male_participants=?, female_participants=?, teacher_feedback=?, session_date=?,
+        session_duration=?, latitude=?, longitude=?
+    WHERE id=?
+'''
+
+_INSERT_PHOTO_SQL = '''
+    INSERT INTO session_photos (session_id, filename, original_filename, file_path, file_size, content_hash)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -22,11 +121,120 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def save_upload(file, file_path):
+    """Stream an uploaded file to disk, returning (size, content hash) or None if it exceeds MAX_FILE_SIZE"""
+    file_size = 0
+    content_hash = hashlib.blake2b(digest_size=32)
+    with open(file_path, 'wb') as out:
+        while chunk := file.stream.read(UPLOAD_CHUNK_SIZE):
+            file_size += len(chunk)
+            if file_size > MAX_FILE_SIZE:
+                break
+            content_hash.update(chunk)
+            out.write(chunk)
+    if file_size > MAX_FILE_SIZE:
+        os.remove(file_path)  # Remove the partial file
+        return None
+    return file_size, content_hash.hexdigest()
+
+def link_duplicate(existing_path, file_path):
+    """Replace a freshly saved upload with a hard link to an identical stored photo"""
+    link_path = file_path + '.link'
+    try:
+        os.link(existing_path, link_path)
+        os.replace(link_path, file_path)
+    except OSError:
+        pass  # Keep the saved copy
+
+# Session rows as returned by _SELECT_SESSIONS_SQL and _CREATE_SESSION_SQL
+@dataclass(slots=True)
+class Session:
+    id: int
+    school_name: str
+    session_type: str
+    location: str
+    activator: str
+    year_group: str
+    male_participants: int
+    female_participants: int
+    teacher_feedback: str | None
+    session_date: str
+    session_duration: int | None
+    date_created: str
+    latitude: float | None
+    longitude: float | None
+    photo_count: int
+    total_participants: int
+
+def session_row(cursor, row):
+    return Session(*row)
+
+# Database connection pool, shared by the threads of one process
+_db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+def _reset_db_pool():
+    """Give a forked worker its own empty pool; SQLite connections must not cross fork()"""
+    global _db_pool
+    _db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+os.register_at_fork(after_in_child=_reset_db_pool)
+
+def connect_db():
+    """Open a tuned connection that can be handed between request threads"""
+    # Pooled connections live across requests, so their prepared-statement cache keeps paying off
+    db = sqlite3.connect(DATABASE, check_same_thread=False, cached_statements=256)
+    db.row_factory = sqlite3.Row
+    # journal_mode=WAL is stored in the database file by init_db()
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.execute('PRAGMA temp_store=MEMORY')
+    db.execute('PRAGMA mmap_size=268435456')
+    db.execute('PRAGMA cache_size=-20000')
+    db.execute('PRAGMA foreign_keys=ON')
+    return db
+
+def get_db():
+    """Return the connection for the current app context, taking one from the pool on first use"""
+    db = g.get('db')
+    if db is None:
+        try:
+            db = _db_pool.get_nowait()
+        except queue.Empty:
+            db = connect_db()
+        g.db = db
+    return db
+
+@app.teardown_appcontext
+def close_db(exception):
+    db = g.pop('db', None)
+    if db is None:
+        return
+    if db.in_transaction:
+        db.rollback()  # Don't hand uncommitted work to the next request
+    try:
+        _db_pool.put_nowait(db)
+    except queue.Full:
+        db.close()
+
 # Database initialization
 def init_db():
-    conn = sqlite3.connect('nzc_activator.db')
+    conn = sqlite3.connect(DATABASE)
     cursor = conn.cursor()
     
+    # WAL lets readers run alongside a writer; the mode persists in the file
+    cursor.execute('PRAGMA journal_mode=WAL')
+    journal_mode = cursor.fetchone()[0]
+    if journal_mode != 'wal':
+        app.logger.warning('SQLite WAL mode unavailable, using %s journal', journal_mode)
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.execute('PRAGMA cache_size=-20000')
+    cursor.execute('PRAGMA foreign_keys=ON')  # Has no effect inside a transaction
+    
+    # Run all DDL, migrations and seeding as one write transaction: one commit
+    # at startup, and a second process starting up waits instead of racing
+    cursor.execute('BEGIN IMMEDIATE')
+    
     # Sessions table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS sessions (
@@ -60,23 +268,128 @@ def init_db():
             FOREIGN KEY (session_id) REFERENCES sessions (id) ON DELETE CASCADE
         )
     ''')
+
+    # Indexes for date filtering/ordering and per-session photo lookups
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sessions_date_created ON sessions (session_date DESC, date_created DESC)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_photos_session ON session_photos (session_id)')
+
+    # One-time setup and schema upgrades, tracked with the database's
+    # user_version so later startups skip the steps already applied
+    cursor.execute('PRAGMA user_version')
+    schema_version = cursor.fetchone()[0]
+    
+    if schema_version < 1:
+        # Insert sample data if sessions table is empty
+        cursor.execute('SELECT COUNT(*) FROM sessions')
+        if cursor.fetchone()[0] == 0:
+            sample_sessions = [
+                ('Auckland Primary School', 'School Festive Day', 'School Hall', 'John Smith', 'Year 5-6', 8, 9, 'Great engagement from students', '2025-01-16', 60, -36.8485, 174.7633),
+                ('Wellington High School', 'Community Hub Practice', 'Gymnasium', 'Sarah Johnson', 'Year 7-8', 65, 62, 'Excellent participation', '2025-01-16', 90, -41.2865, 174.7762),
+                ('Christchurch College', 'Girl\'s Cricket Programme', 'Sports Field', 'Mike Wilson', 'Year 9-10', 15, 13, 'Good skill development', '2025-01-16', 45, -43.5321, 172.6362),
+                ('Hamilton Elementary', 'Kiwi Cricket Skills Session', 'Community Center', 'Lisa Brown', 'Year 3-4', 12, 15, 'Very enthusiastic group', '2025-01-15', 75, -37.7870, 175.2793),
+                ('Dunedin Academy', 'In2Cricket Taster', 'Main Hall', 'David Lee', 'Year 6-7', 20, 18, 'Positive feedback', '2025-01-15', 120, -45.8788, 170.5028),
+            ]
+        
+            # date_created uses the column default
+            cursor.executemany(_INSERT_SESSION_SQL, sample_sessions)
+        
+        cursor.execute('PRAGMA user_version = 1')
+    
+    if schema_version < 2:
+        # Content hashes let identical photo uploads share one file on disk
+        cursor.execute('ALTER TABLE session_photos ADD COLUMN content_hash TEXT')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_photos_content_hash ON session_photos (content_hash)')
+        cursor.execute('PRAGMA user_version = 2')
+    
+    if schema_version < 3:
+        # Covering index for the stats query; supersedes the plain session_date index
+        cursor.execute('DROP INDEX IF EXISTS idx_sessions_date')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sessions_date_parts
+            ON sessions (session_date, male_participants, female_participants)
+        ''')
+        cursor.execute('PRAGMA user_version = 3')
+    
+    if schema_version < 4:
+        # Per-day participant totals for /api/stats, kept current by triggers
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS daily_totals (
+                session_date DATE PRIMARY KEY,
+                total INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_daily_totals_insert AFTER INSERT ON sessions
+            BEGIN
+                INSERT INTO daily_totals (session_date, total)
+                VALUES (NEW.session_date, NEW.male_participants + NEW.female_participants)
+                ON CONFLICT (session_date) DO UPDATE SET total = total + excluded.total;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_daily_totals_delete AFTER DELETE ON sessions
+            BEGIN
+                UPDATE daily_totals SET total = total - (OLD.male_participants + OLD.female_participants)
+                WHERE session_date = OLD.session_date;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_daily_totals_update
+            AFTER UPDATE OF session_date, male_participants, female_participants ON sessions
+            BEGIN
+                UPDATE daily_totals SET total = total - (OLD.male_participants + OLD.female_participants)
+                WHERE session_date = OLD.session_date;
+                INSERT INTO daily_totals (session_date, total)
+                VALUES (NEW.session_date, NEW.male_participants + NEW.female_participants)
+                ON CONFLICT (session_date) DO UPDATE SET total = total + excluded.total;
+            END
+        ''')
+        cursor.execute('DELETE FROM daily_totals')
+        cursor.execute('''
+            INSERT INTO daily_totals (session_date, total)
+            SELECT session_date, SUM(male_participants + female_participants)
+            FROM sessions
+            GROUP BY session_date
+        ''')
+        # Stats read daily_totals now, so the v3 covering index only slows writes
+        cursor.execute('DROP INDEX IF EXISTS idx_sessions_date_parts')
+        cursor.execute('PRAGMA user_version = 4')
     
-    # Insert sample data if sessions table is empty
-    cursor.execute('SELECT COUNT(*) FROM sessions')
-    if cursor.fetchone()[0] == 0:
-        sample_sessions = [
-            ('Auckland Primary School', 'School Festive Day', 'School Hall', 'John Smith', 'Year 5-6', 8, 9, 'Great engagement from students', '2025-01-16', 60, '2025-01-16 10:00:00', -36.8485, 174.7633),
-            ('Wellington High School', 'Community Hub Practice', 'Gymnasium', 'Sarah Johnson', 'Year 7-8', 65, 62, 'Excellent participation', '2025-01-16', 90, '2025-01-16 14:00:00', -41.2865, 174.7762),
-            ('Christchurch College', 'Girl\'s Cricket Programme', 'Sports Field', 'Mike Wilson', 'Year 9-10', 15, 13, 'Good skill development', '2025-01-16', 45, '2025-01-16 16:00:00', -43.5321, 172.6362),
-            ('Hamilton Elementary', 'Kiwi Cricket Skills Session', 'Community Center', 'Lisa Brown', 'Year 3-4', 12, 15, 'Very enthusiastic group', '2025-01-15', 75, '2025-01-15 11:00:00', -37.7870, 175.2793),
-            ('Dunedin Academy', 'In2Cricket Taster', 'Main Hall', 'David Lee', 'Year 6-7', 20, 18, 'Positive feedback', '2025-01-15', 120, '2025-01-15 13:00:00', -45.8788, 170.5028),
-        ]
-        
-        cursor.executemany('''
-            INSERT INTO sessions (school_name, session_type, location, activator, year_group, male_participants, female_participants, teacher_feedback, session_date, session_duration, date_created, latitude, longitude)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', sample_sessions)
+    if schema_version < 5:
+        # Counter bumped by every write, used to build ETags for the read endpoints
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS data_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        ''')
+        # Start from a random 48-bit value, not 0, so a recreated database can't
+        # hand out a version a browser already cached from the previous one
+        cursor.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, random() & 0xFFFFFFFFFFFF)')
+        for table in ('sessions', 'session_photos'):
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_data_version_{table}_{event.lower()}
+                    AFTER {event} ON {table}
+                    BEGIN
+                        UPDATE data_version SET version = version + 1 WHERE id = 1;
+                    END
+                ''')
+        cursor.execute('PRAGMA user_version = 5')
     
+    if schema_version < 6:
+        # SQLite can only add VIRTUAL generated columns to an existing table
+        cursor.execute('''
+            ALTER TABLE sessions ADD COLUMN total_participants INTEGER
+            GENERATED ALWAYS AS (male_participants + female_participants) VIRTUAL
+        ''')
+        cursor.execute('PRAGMA user_version = 6')
+
+    # Refresh planner statistics on every startup so they follow the data
+    # (e.g. content hashes filling in); analysis_limit keeps this cheap
+    cursor.execute('PRAGMA analysis_limit=400')
+    cursor.execute('ANALYZE')
+
     conn.commit()
     conn.close()
 
@@ -86,66 +399,37 @@ def validate_session_data(data):
     errors = []
     
     # Required fields validation
-    required_fields = ['school_name', 'session_type', 'location', 'activator', 'year_group', 
-                      'male_participants', 'female_participants', 'session_date', 'session_duration']
-    
-    for field in required_fields:
-        if not data.get(field) or str(data.get(field)).strip() == '':
+    for field in _REQUIRED_FIELDS:
+        if not (value := data.get(field)) or not str(value).strip():
             errors.append(f"{field.replace('_', ' ').title()} is required")
     
-    # School name validation
-    if data.get('school_name'):
-        if len(data['school_name'].strip()) < 2:
-            errors.append("School name must be at least 2 characters long")
-        if len(data['school_name'].strip()) > 100:
-            errors.append("School name must be less than 100 characters")
-    
-    # Session type validation
-    if data.get('session_type'):
-        if len(data['session_type'].strip()) < 2:
-            errors.append("Session type must be at least 2 characters long")
-        if len(data['session_type'].strip()) > 50:
-            errors.append("Session type must be less than 50 characters")
-    
-    # Location validation
-    if data.get('location'):
-        if len(data['location'].strip()) < 2:
-            errors.append("Location must be at least 2 characters long")
-        if len(data['location'].strip()) > 100:
-            errors.append("Location must be less than 100 characters")
+    # Text length validation
+    for field, label, min_length, max_length in _TEXT_FIELD_LIMITS:
+        if value := data.get(field):
+            length = len(value.strip())
+            if length < min_length:
+                errors.append(f"{label} must be at least {min_length} characters long")
+            if length > max_length:
+                errors.append(f"{label} must be less than {max_length} characters")
     
     # Activator validation
-    if data.get('activator'):
-        if len(data['activator'].strip()) < 2:
-            errors.append("Activator name must be at least 2 characters long")
-        if len(data['activator'].strip()) > 50:
-            errors.append("Activator name must be less than 50 characters")
-        if not re.match(r'^[a-zA-Z\s\-\.]+$', data['activator'].strip()):
-            errors.append("Activator name can only contain letters, spaces, hyphens, and periods")
+    if data.get('activator') and not _ACTIVATOR_RE.match(data['activator'].strip()):
+        errors.append("Activator name can only contain letters, spaces, hyphens, and periods")
     
     # Year group validation
-    valid_year_groups = ['Year 1-2', 'Year 3-4', 'Year 5-6', 'Year 7-8', 'Year 9-10', 'Year 11-13', 'Mixed']
-    if data.get('year_group') and data['year_group'] not in valid_year_groups:
+    if data.get('year_group') and data['year_group'] not in _VALID_YEAR_GROUPS:
         errors.append("Please select a valid year group")
     
     # Participants validation
-    try:
-        male_participants = int(data.get('male_participants', 0))
-        if male_participants < 0:
-            errors.append("Male participants cannot be negative")
-        if male_participants > 1000:
-            errors.append("Male participants seems too high (max 1000)")
-    except (ValueError, TypeError):
-        errors.append("Male participants must be a valid number")
-    
-    try:
-        female_participants = int(data.get('female_participants', 0))
-        if female_participants < 0:
-            errors.append("Female participants cannot be negative")
-        if female_participants > 1000:
-            errors.append("Female participants seems too high (max 1000)")
-    except (ValueError, TypeError):
-        errors.append("Female participants must be a valid number")
+    for field, label in _PARTICIPANT_FIELDS:
+        try:
+            participants = int(data.get(field, 0))
+            if participants < 0:
+                errors.append(f"{label} cannot be negative")
+            if participants > 1000:
+                errors.append(f"{label} seems too high (max 1000)")
+        except (ValueError, TypeError):
+            errors.append(f"{label} must be a valid number")
     
     # Check total participants
     try:
@@ -202,6 +486,24 @@ def validate_session_data(data):
     
     return errors
 
+def session_params(data):
+    """Convert validated session data to SQL parameters; empty optional fields become NULL"""
+    return tuple(
+        convert(value) if (value := data.get(field)) or not optional else None
+        for field, convert, optional in _SESSION_FIELDS
+    )
+
+# HTTP caching for the read endpoints
+def current_data_version():
+    return get_db().execute('SELECT version FROM data_version').fetchone()[0]
+
+def with_etag(response, etag, vary=()):
+    """Tag a response so clients revalidate with If-None-Match instead of re-downloading"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = API_CACHE_CONTROL
+    response.vary.update(vary)  # Also on 304s, so caches match the right variant
+    return response
+
 # Routes
 @app.route('/')
 def home():
@@ -236,48 +538,39 @@ def uploaded_file(filename):
 # API Routes
 @app.route('/api/sessions', methods=['GET'])
 def get_sessions():
-    conn = sqlite3.connect('nzc_activator.db')
-    cursor = conn.cursor()
+    # Clients that ask for NDJSON get one session per line; everyone else gets a JSON array
+    ndjson = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
     
-    cursor.execute('''
-        SELECT s.id, s.school_name, s.session_type, s.location, s.activator, s.year_group, 
-               s.male_participants, s.female_participants, s.teacher_feedback, s.session_date, 
-               s.session_duration, s.date_created, s.latitude, s.longitude,
-               COUNT(sp.id) as photo_count
-        FROM sessions s
-        LEFT JOIN session_photos sp ON s.id = sp.session_id
-        GROUP BY s.id
-        ORDER BY s.session_date DESC, s.date_created DESC
-    ''')
+    etag = f"sessions-{current_data_version()}{'-ndjson' if ndjson else ''}"
+    if request.if_none_match.contains_weak(etag):
+        return with_etag(Response(status=304), etag, vary=['Accept'])
     
-    sessions = []
-    for row in cursor.fetchall():
-        sessions.append({
-            'id': row[0],
-            'school_name': row[1],
-            'session_type': row[2],
-            'location': row[3],
-            'activator': row[4],
-            'year_group': row[5],
-            'male_participants': row[6],
-            'female_participants': row[7],
-            'teacher_feedback': row[8],
-            'session_date': row[9],
-            'session_duration': row[10],
-            'date_created': row[11],
-            'latitude': row[12],
-            'longitude': row[13],
-            'photo_count': row[14],
-            'total_participants': row[6] + row[7]
-        })
+    # Stream rows in batches instead of building the whole list first.
+    # The query runs inside the generator so it uses the streaming context's connection.
+    def generate():
+        cursor = get_db().cursor()
+        cursor.row_factory = session_row
+        cursor.arraysize = STREAM_BATCH_SIZE
+        cursor.execute(_SELECT_SESSIONS_SQL)
+        
+        if ndjson:
+            while rows := cursor.fetchmany():
+                yield ''.join(app.json.dumps(row) + '\n' for row in rows)
+            return
+        
+        separator = '['
+        while rows := cursor.fetchmany():
+            yield separator + ','.join(app.json.dumps(row) for row in rows)
+            separator = ','
+        yield '[]' if separator == '[' else ']'
     
-    conn.close()
-    return jsonify(sessions)
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    return with_etag(Response(stream_with_context(generate()), mimetype=mimetype), etag, vary=['Accept'])
 
 @app.route('/api/sessions', methods=['POST'])
 def create_session():
     try:
-        data = request.json
+        data = request.get_json(cache=False)
         if not data:
             return jsonify({'success': False, 'errors': ['No data provided']}), 400
         
@@ -286,34 +579,20 @@ def create_session():
         if validation_errors:
             return jsonify({'success': False, 'errors': validation_errors}), 400
         
-        conn = sqlite3.connect('nzc_activator.db')
+        conn = get_db()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            INSERT INTO sessions (school_name, session_type, location, activator, year_group, 
-                                male_participants, female_participants, teacher_feedback, session_date,
-                                session_duration, latitude, longitude)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            data['school_name'].strip(),
-            data['session_type'].strip(),
-            data['location'].strip(),
-            data['activator'].strip(),
-            data['year_group'],
-            int(data['male_participants']),
-            int(data['female_participants']),
-            data.get('teacher_feedback', '').strip() if data.get('teacher_feedback') else None,
-            data['session_date'],
-            int(data['session_duration']),
-            float(data['latitude']) if data.get('latitude') else None,
-            float(data['longitude']) if data.get('longitude') else None
-        ))
-        
-        session_id = cursor.lastrowid
+        cursor.row_factory = session_row
+        cursor.execute(_CREATE_SESSION_SQL, session_params(data))
+        session = cursor.fetchone()
         conn.commit()
-        conn.close()
         
-        return jsonify({'success': True, 'message': 'Session recorded successfully', 'session_id': session_id})
+        return jsonify({
+            'success': True,
+            'message': 'Session recorded successfully',
+            'session_id': session.id,
+            'session': session
+        })
         
     except Exception as e:
         return jsonify({'success': False, 'errors': [f'Server error: {str(e)}']}), 500
@@ -321,19 +600,21 @@ def create_session():
 @app.route('/api/sessions/<int:session_id>/photos', methods=['POST'])
 def upload_photos(session_id):
     try:
-        # Check if session exists
-        conn = sqlite3.connect('nzc_activator.db')
+        conn = get_db()
         cursor = conn.cursor()
-        cursor.execute('SELECT id FROM sessions WHERE id = ?', (session_id,))
-        if not cursor.fetchone():
-            conn.close()
-            return jsonify({'success': False, 'errors': ['Session not found']}), 404
         
         if 'photos' not in request.files:
             return jsonify({'success': False, 'errors': ['No photos provided']}), 400
         
+        # Check the session exists before writing any files to disk
+        cursor.execute('SELECT 1 FROM sessions WHERE id = ?', (session_id,))
+        if not cursor.fetchone():
+            return jsonify({'success': False, 'errors': ['Session not found']}), 404
+        
         files = request.files.getlist('photos')
         uploaded_photos = []
+        photo_rows = []
+        paths_by_hash = {}
         
         for file in files:
             if file.filename == '':
@@ -347,29 +628,37 @@ def upload_photos(session_id):
             unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
             file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
             
-            # Save file
-            file.save(file_path)
-            file_size = os.path.getsize(file_path)
-            
-            # Check file size
-            if file_size > MAX_FILE_SIZE:
-                os.remove(file_path)  # Remove the file
+            # Save file, stopping as soon as it exceeds the size limit
+            saved = save_upload(file, file_path)
+            if saved is None:
                 return jsonify({'success': False, 'errors': [f'File {file.filename} is too large (max 5MB)']}), 400
+            file_size, content_hash = saved
             
-            # Save to database
-            cursor.execute('''
-                INSERT INTO session_photos (session_id, filename, original_filename, file_path, file_size)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (session_id, unique_filename, file.filename, file_path, file_size))
+            # Share disk space with an identical photo that is already stored
+            existing_path = paths_by_hash.get(content_hash)
+            if existing_path is None:
+                cursor.execute('SELECT file_path FROM session_photos WHERE content_hash = ? LIMIT 1', (content_hash,))
+                existing = cursor.fetchone()
+                existing_path = existing['file_path'] if existing else None
+            if existing_path is not None:
+                link_duplicate(existing_path, file_path)
+            paths_by_hash[content_hash] = file_path
             
+            photo_rows.append((session_id, unique_filename, file.filename, file_path, file_size, content_hash))
             uploaded_photos.append({
                 'filename': unique_filename,
                 'original_filename': file.filename,
                 'size': file_size
             })
         
+        # Save all photos to database in one batch; the foreign key catches a session deleted meanwhile
+        try:
+            cursor.executemany(_INSERT_PHOTO_SQL, photo_rows)
+        except sqlite3.IntegrityError:
+            for row in photo_rows:
+                os.remove(row[3])  # Remove the saved file
+            return jsonify({'success': False, 'errors': ['Session not found']}), 404
         conn.commit()
-        conn.close()
         
         return jsonify({
             'success': True, 
@@ -377,13 +666,15 @@ def upload_photos(session_id):
             'photos': uploaded_photos
         })
         
+    except RequestEntityTooLarge:
+        return jsonify({'success': False, 'errors': [f'Upload is too large (max {MAX_UPLOAD_SIZE // (1024 * 1024)}MB per request)']}), 413
     except Exception as e:
         return jsonify({'success': False, 'errors': [f'Server error: {str(e)}']}), 500
 
 @app.route('/api/sessions/<int:session_id>/photos', methods=['GET'])
 def get_session_photos(session_id):
     try:
-        conn = sqlite3.connect('nzc_activator.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -393,18 +684,8 @@ def get_session_photos(session_id):
             ORDER BY upload_date DESC
         ''', (session_id,))
         
-        photos = []
-        for row in cursor.fetchall():
-            photos.append({
-                'id': row[0],
-                'filename': row[1],
-                'original_filename': row[2],
-                'file_size': row[3],
-                'upload_date': row[4],
-                'url': f'/uploads/photos/{row[1]}'
-            })
+        photos = [{**row, 'url': f"/uploads/photos/{row['filename']}"} for row in cursor.fetchall()]
         
-        conn.close()
         return jsonify({'success': True, 'photos': photos})
         
     except Exception as e:
@@ -413,30 +694,25 @@ def get_session_photos(session_id):
 @app.route('/api/sessions/<int:session_id>/photos/<int:photo_id>', methods=['DELETE'])
 def delete_photo(session_id, photo_id):
     try:
-        conn = sqlite3.connect('nzc_activator.db')
+        conn = get_db()
         cursor = conn.cursor()
         
-        # Get photo info
-        cursor.execute('SELECT filename, file_path FROM session_photos WHERE id = ? AND session_id = ?', 
+        # Delete from database, getting the file path back in the same statement
+        cursor.execute('DELETE FROM session_photos WHERE id = ? AND session_id = ? RETURNING file_path',
                       (photo_id, session_id))
         photo = cursor.fetchone()
         
         if not photo:
-            conn.close()
             return jsonify({'success': False, 'errors': ['Photo not found']}), 404
         
-        # Delete file from filesystem
+        conn.commit()
+        
+        # Delete file from filesystem once the row is gone
         try:
-            if os.path.exists(photo[1]):
-                os.remove(photo[1])
+            os.unlink(photo[0])
         except OSError:
             pass  # File might already be deleted
         
-        # Delete from database
-        cursor.execute('DELETE FROM session_photos WHERE id = ? AND session_id = ?', (photo_id, session_id))
-        conn.commit()
-        conn.close()
-        
         return jsonify({'success': True, 'message': 'Photo deleted successfully'})
         
     except Exception as e:
@@ -445,7 +721,7 @@ def delete_photo(session_id, photo_id):
 @app.route('/api/sessions/<int:session_id>', methods=['PUT'])
 def update_session(session_id):
     try:
-        data = request.json
+        data = request.get_json(cache=False)
         if not data:
             return jsonify({'success': False, 'errors': ['No data provided']}), 400
         
@@ -454,39 +730,15 @@ def update_session(session_id):
         if validation_errors:
             return jsonify({'success': False, 'errors': validation_errors}), 400
         
-        conn = sqlite3.connect('nzc_activator.db')
+        conn = get_db()
         cursor = conn.cursor()
         
-        # Check if session exists
-        cursor.execute('SELECT id FROM sessions WHERE id = ?', (session_id,))
-        if not cursor.fetchone():
-            conn.close()
-            return jsonify({'success': False, 'errors': ['Session not found']}), 404
+        cursor.execute(_UPDATE_SESSION_SQL, (*session_params(data), session_id))
         
-        cursor.execute('''
-            UPDATE sessions 
-            SET school_name=?, session_type=?, location=?, activator=?, year_group=?, 
-                male_participants=?, female_participants=?, teacher_feedback=?, session_date=?,
-                session_duration=?, latitude=?, longitude=?
-            WHERE id=?
-        ''', (
-            data['school_name'].strip(),
-            data['session_type'].strip(),
-            data['location'].strip(),
-            data['activator'].strip(),
-            data['year_group'],
-            int(data['male_participants']),
-            int(data['female_participants']),
-            data.get('teacher_feedback', '').strip() if data.get('teacher_feedback') else None,
-            data['session_date'],
-            int(data['session_duration']),
-            float(data['latitude']) if data.get('latitude') else None,
-            float(data['longitude']) if data.get('longitude') else None,
-            session_id
-        ))
+        if cursor.rowcount == 0:
+            return jsonify({'success': False, 'errors': ['Session not found']}), 404
         
         conn.commit()
-        conn.close()
         
         return jsonify({'success': True, 'message': 'Session updated successfully'})
         
@@ -496,26 +748,24 @@ def update_session(session_id):
 @app.route('/api/sessions/<int:session_id>', methods=['DELETE'])
 def delete_session(session_id):
     try:
-        conn = sqlite3.connect('nzc_activator.db')
+        conn = get_db()
         cursor = conn.cursor()
         
         # Get all photos for this session to delete files
         cursor.execute('SELECT file_path FROM session_photos WHERE session_id = ?', (session_id,))
         photos = cursor.fetchall()
         
-        # Delete photo files
-        for photo in photos:
-            try:
-                if os.path.exists(photo[0]):
-                    os.remove(photo[0])
-            except OSError:
-                pass  # File might already be deleted
-        
         # Delete session (photos will be deleted due to CASCADE)
         cursor.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
         
         conn.commit()
-        conn.close()
+        
+        # Delete photo files only after the commit succeeded
+        for photo in photos:
+            try:
+                os.unlink(photo[0])
+            except OSError:
+                pass  # File might already be deleted
         
         return jsonify({'success': True, 'message': 'Session deleted successfully'})
         
@@ -524,43 +774,46 @@ def delete_session(session_id):
 
 @app.route('/api/stats')
 def get_stats():
-    conn = sqlite3.connect('nzc_activator.db')
+    today = date.today()
+    
+    # The stats depend on today's date as well as the data
+    etag = f"stats-{current_data_version()}-{today.isoformat()}"
+    if request.if_none_match.contains_weak(etag):
+        return with_etag(Response(status=304), etag)
+    
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get total participants in last 7 days
-    seven_days_ago = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
-    cursor.execute('''
-        SELECT SUM(male_participants + female_participants) 
-        FROM sessions 
-        WHERE session_date >= ?
-    ''', (seven_days_ago,))
+    days = [today - timedelta(days=6-i) for i in range(7)]
+    
+    # Get daily participation for last 7 days from the precomputed totals
+    cursor.execute('SELECT session_date, total FROM daily_totals WHERE session_date >= ?', (days[0].isoformat(),))
     
-    recent_participants = cursor.fetchone()[0] or 0
+    participants_by_date = dict(cursor.fetchall())
     
-    # Get daily participation for last 7 days
     daily_stats = []
-    for i in range(7):
-        date = (datetime.now() - timedelta(days=6-i)).strftime('%Y-%m-%d')
-        cursor.execute('''
-            SELECT SUM(male_participants + female_participants) 
-            FROM sessions 
-            WHERE session_date = ?
-        ''', (date,))
-        
-        participants = cursor.fetchone()[0] or 0
+    for day in days:
+        day_str = day.isoformat()
         daily_stats.append({
-            'date': date,
-            'participants': participants,
-            'day': (datetime.now() - timedelta(days=6-i)).strftime('%a')
+            'date': day_str,
+            'participants': participants_by_date.get(day_str, 0),
+            'day': day.strftime('%a')
         })
     
-    conn.close()
+    # Total only the days shown, so rows dated after today can't inflate it
+    recent_participants = sum(day['participants'] for day in daily_stats)
     
-    return jsonify({
+    return with_etag(jsonify({
         'recent_participants': recent_participants,
         'daily_stats': daily_stats
-    })
+    }), etag)
+
+# Create tables on import so WSGI servers (gunicorn app:app) get them too
+init_db()
 
 if __name__ == '__main__':
-    init_db()
-    app.run(host='0.0.0.0', port=10000, debug=False)
+    # Debug mode (reloader + debugger) only for local development, and never
+    # reachable from the network since the debugger can run arbitrary code
+    debug = get_debug_flag()
+    host = '127.0.0.1' if debug else '0.0.0.0'
+    app.run(host=host, port=int(os.environ.get('PORT', 10000)), debug=debug)
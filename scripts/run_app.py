@@ -20,7 +20,7 @@ def run_flask_app():
         
         # Set Flask environment variables
         os.environ['FLASK_APP'] = 'app.py'
-        os.environ['FLASK_ENV'] = 'development'
+        os.environ['FLASK_DEBUG'] = '1'
         
         print("🚀 Starting NZC Activator application...")
         print("📱 Open your browser and go to: http://localhost:5000")